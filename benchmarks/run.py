@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+"""
+Runs benchmarks over dolfin's data paths and compares the results against a
+stored baseline.
+
+Each benchmark is run repeatedly for at least `--min-time` seconds per round
+and the best of `--repeat` rounds is reported as throughput, then it is run
+once more under tracemalloc to report peak memory and the number of memory
+blocks left allocated. All inputs, XLSX files inclusive, are generated locally
+into a temporary directory, thus no network or database server is needed.
+Baselines are kept separately for full and `--quick` runs.
+
+Peak memory and blocks are compared against the baseline to detect
+regressions. Throughput is shown normalised against a calibration loop timed
+with each run; as timings vary with machine load, it is only gated with
+`--gate-throughput` and when the baseline was recorded on the same host.
+
+usage: python -m benchmarks.run [--quick] [--save] [--baseline FILE]
+"""
+import gc
+import os
+import sys
+import json
+import time
+import platform
+import sqlite3
+import tempfile
+import tracemalloc
+from argparse import ArgumentParser
+
+from dolfin import Storage, FrozenStorage
+from dolfin.data import Db, XlSheet, XlSheetWriter, XlColumn, \
+     TypedXlReaderBase
+
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+class Benchmark:
+    """
+    Represents a named benchmark. `setup` returns the input passed to `run`,
+    which returns the number of items processed.
+    """
+
+    def __init__(self, name, setup, run):
+        self.name = name
+        self.setup = setup
+        self.run = run
+
+    def measure(self, repeat, min_time=0.2):
+        best, items = (None, 0)
+        for i in range(repeat):
+            count, elapsed = (0, 0.0)
+            while elapsed < min_time:
+                data = self.setup()
+                started = time.perf_counter()
+                items = self.run(data)
+                elapsed += time.perf_counter() - started
+                count += items
+            throughput = count / elapsed if elapsed else 0.0
+            best = throughput if best is None else max(best, throughput)
+
+        # the lower of two traced runs leaves out one-off allocations such as
+        # caches filled on first use
+        blocks, peak = (min(v) for v in zip(self.trace(), self.trace()))
+        return Storage(
+            items=items, blocks=blocks, peak_kb=peak // 1024, throughput=best
+        )
+
+    def trace(self):
+        data = self.setup()
+        gc.collect()
+        tracemalloc.start()
+        try:
+            self.run(data)
+            gc.collect()
+            blocks = sum(s.count for s in
+                tracemalloc.take_snapshot().statistics('filename'))
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        return blocks, peak
+
+
+def calibrate(repeat, min_time=0.2):
+    """
+    Returns the best time in seconds taken by a fixed pure Python loop, used
+    to normalise throughput across runs on differently loaded machines.
+    """
+    def run(data):
+        total = 0
+        for i in range(100000):
+            total += i * i
+        return 1
+
+    result = Benchmark('calibration', lambda: None, run).measure(
+        repeat, min_time)
+    return 1.0 / result.throughput
+
+
+## storage
+
+def _make_nested(count):
+    return [dict(id=i, name='name-%s' % i, meta=dict(tags=dict(a=1, b=2)))
+            for i in range(count)]
+
+
+def _run_storage_make(records):
+    for r in records:
+        Storage.make(r)
+    return len(records)
+
+
+def _run_storage_access(records):
+    for r in records:
+        r.id, r.name, r.meta, r.missing
+    return len(records)
+
+
+def _run_frozen_storage_hash(records):
+    cache = {}
+    for r in records:
+        cache[FrozenStorage.make(r)] = r
+    return len(records)
+
+
+## excel
+
+def _make_workbook(filepath, rows, cols, inflated=False):
+    import openpyxl
+
+    workbook = openpyxl.Workbook()
+    worksheet = workbook.active
+    worksheet.title = 'data'
+    worksheet.append(['col%s' % j for j in range(cols)])
+    for i in range(rows):
+        worksheet.append([i * j for j in range(cols)])
+    if inflated:
+        worksheet.cell(row=rows * 20, column=cols * 20).number_format = '0.00'
+    workbook.save(filepath)
+    return filepath
+
+
+def _run_xlsheet_iter(filepath):
+    xlsheet = XlSheet(filepath, 'data')
+    return sum(1 for row in xlsheet)
+
+
+def _run_find_headers(filepath):
+    xlsheet = XlSheet(filepath, 'data', row_offset=0)
+    XlSheet.find_headers(xlsheet, ['col0', 'col1'])
+    return 1
+
+
+class _Reader(TypedXlReaderBase):
+    sample_headers = ('col0', 'col1')
+    schema = tuple(XlColumn('col%s' % j, int) for j in range(10))
+
+
+def _run_typed_reader(filepath):
+    return sum(1 for row in _Reader(XlSheet(filepath, 'data')).get_rows())
+
+
+def _run_xlsheet_writer(rows):
+    handle, filepath = tempfile.mkstemp(suffix='.xlsx')
+    os.close(handle)
+    try:
+        with XlSheetWriter(filepath, 'data') as writer:
+            return writer.write_rows(rows)
+    finally:
+        os.remove(filepath)
+
+
+## db
+
+def _make_db(count):
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE people (id INTEGER PRIMARY KEY, name TEXT)')
+    conn.executemany('INSERT INTO people VALUES (?, ?)', [
+        (i, 'name-%s' % i) for i in range(count)
+    ])
+    conn.commit()
+    return conn
+
+
+def _run_row_provider(conn):
+    return sum(1 for row in Db.make_row_provider(conn, 'people'))
+
+
+def _make_process_input(count):
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE people (id INTEGER PRIMARY KEY, name TEXT)')
+    return conn, count
+
+
+def _run_process(data):
+    conn, count = data
+    dml_provider = Db.make_dml_provider(
+        lambda i: "INSERT INTO people VALUES (%s, 'name-%s')" % (i, i),
+        # every tenth statement fails on a duplicate key
+        (i - (i % 10 == 9) for i in range(count))
+    )
+    results = Db.process(
+        conn, dml_provider, commit_interval=1000,
+        on_dml_processed=lambda *a: None
+    )
+    results.errors.discard()
+    return results.passed + results.failed
+
+
+def get_benchmarks(workdir, scale=1):
+    size = lambda n: max(1, n // scale)
+    nested, storages = (size(20000), size(50000))
+    benchmarks = [
+        Benchmark('storage.make[%s]' % nested,
+            lambda: _make_nested(nested), _run_storage_make),
+        Benchmark('storage.access[%s]' % storages,
+            lambda: [Storage(r) for r in _make_nested(storages)],
+            _run_storage_access),
+        Benchmark('frozen_storage.hash[%s]' % nested,
+            lambda: _make_nested(nested), _run_frozen_storage_hash),
+    ]
+
+    for rows, cols, inflated in ((size(2000), 10, False),
+                                 (size(200), 100, False),
+                                 (size(200), 10, True)):
+        shape = '%sx%s%s' % (rows, cols, ' inflated' if inflated else '')
+        filepath = _make_workbook(
+            os.path.join(workdir, 'data-%s.xlsx' % shape.replace(' ', '-')),
+            rows, cols, inflated)
+        make = (lambda f: lambda: f)(filepath)
+        benchmarks.append(Benchmark('xlsheet.iter[%s]' % shape, make,
+            _run_xlsheet_iter))
+        benchmarks.append(Benchmark('xlsheet.find_headers[%s]' % shape, make,
+            _run_find_headers))
+
+    rows = size(2000)
+    filepath = _make_workbook(
+        os.path.join(workdir, 'typed.xlsx'), rows, 10)
+    benchmarks.append(Benchmark('typed_reader.schema[%sx10]' % rows,
+        lambda: filepath, _run_typed_reader))
+    benchmarks.append(Benchmark('xlsheet_writer[%s]' % size(20000),
+        lambda: Db.make_row_provider(_make_db(size(20000)), 'people'),
+        _run_xlsheet_writer))
+
+    for count in (size(1000), size(10000), size(100000)):
+        benchmarks.append(Benchmark('db.row_provider[%s]' % count,
+            (lambda n: lambda: _make_db(n))(count), _run_row_provider))
+        benchmarks.append(Benchmark('db.process[%s]' % count,
+            (lambda n: lambda: _make_process_input(n))(count), _run_process))
+    return benchmarks
+
+
+def compare(results, calibration, baseline, tolerance,
+    gate_throughput=False):
+    """
+    Prints results next to the baseline and returns the names of benchmarks
+    whose peak memory or blocks grew beyond tolerance or, if gated, whose
+    normalised throughput dropped beyond tolerance. Throughput is not gated
+    for baselines of other hosts.
+    """
+    regressions, base_results = ([], baseline.get('results', {}))
+    same_host = baseline.get('host') == platform.node()
+    gate_throughput = gate_throughput and same_host
+    line = '%-40s %14s %10s %10s %10s'
+    print(line % ('benchmark', 'items/s', 'peak KiB', 'blocks', 'vs base'))
+    for name, result in results.items():
+        base, delta, failed = (base_results.get(name), '', False)
+        if base:
+            ratio = (result.throughput * calibration /
+                     (base['throughput'] * baseline['calibration']))
+            delta = '%+.1f%%' % ((ratio - 1) * 100)
+            grown = lambda key, slack: (
+                result[key] > base[key] * (1 + tolerance) + slack)
+            failed = (grown('peak_kb', 64) or grown('blocks', 256) or
+                      (gate_throughput and ratio < 1 - tolerance))
+        if failed:
+            regressions.append(name)
+            delta += ' !'
+        print(line % (name, '%.0f' % result.throughput, result.peak_kb,
+            result.blocks, delta))
+    if base_results and not same_host:
+        print('baseline from another host: throughput not gated')
+    return regressions
+
+
+def main(argv=None):
+    parser = ArgumentParser(prog='benchmarks.run', description=(
+        'Runs benchmarks for dolfin data paths and compares against a '
+        'stored baseline.'))
+    add = lambda *a, **k: parser.add_argument(*a, **k)
+    add('--baseline', default=BASELINE, help='baseline JSON file')
+    add('--save', action='store_true', help='save results as the baseline')
+    add('--quick', action='store_true', help='run with reduced sizes')
+    add('--repeat', type=int, default=3, help='timed rounds per benchmark')
+    add('--min-time', type=float, default=0.2,
+        help='minimum seconds per timed round')
+    add('--tolerance', type=float, default=0.3,
+        help='allowed relative slowdown or memory growth')
+    add('--gate-throughput', action='store_true',
+        help='also fail on normalised throughput drops')
+    add('-k', '--keyword', help='only run benchmarks containing keyword')
+    args = parser.parse_args(argv)
+
+    results = {}
+    calibration = calibrate(args.repeat, args.min_time)
+    with tempfile.TemporaryDirectory(prefix='dolfin-bench-') as workdir:
+        benchmarks = get_benchmarks(workdir, scale=4 if args.quick else 1)
+        for benchmark in benchmarks:
+            if args.keyword and args.keyword not in benchmark.name:
+                continue
+            results[benchmark.name] = benchmark.measure(
+                args.repeat, args.min_time)
+
+    baselines, mode = ({}, 'quick' if args.quick else 'full')
+    if os.path.isfile(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    baseline = baselines.setdefault(mode, {})
+    
+    regressions = compare(results, calibration, baseline, args.tolerance,
+        args.gate_throughput)
+    if args.save:
+        if baseline.get('host') != platform.node():
+            baseline.clear()
+        baseline.update(host=platform.node(), calibration=calibration)
+        baseline.setdefault('results', {}).update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('baseline saved: %s' % args.baseline)
+    elif regressions:
+        print('regressions: %s' % ', '.join(regressions))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -8,7 +8,9 @@ import sys
 from abc import ABCMeta, abstractmethod
 
 
-__all__ = ['CommandError', 'Command', 'SubCommand', 'Storage']
+__all__ = [
+    'CommandError', 'Command', 'SubCommand', 'Storage', 'FrozenStorage'
+]
 
 
 
@@ -57,6 +59,72 @@ class Storage(dict):
         return _make(obj)
 
 
+class FrozenStorage(Storage):
+    """
+    Represents an immutable and hashable `Storage` object. Elements are still
+    accessed using the dot object notation and missing elements resolve to
+    None, but cannot be set or removed. The hash is computed on first use and
+    cached, thus instances work well as memoization keys.
+    """
+
+    def __hash__(self):
+        # Storage resolves unknown attributes to None, thus check __dict__
+        value = self.__dict__.get('_FrozenStorage__hash')
+        if value is None:
+            value = hash(frozenset(dict.items(self)))
+            object.__setattr__(self, '_FrozenStorage__hash', value)
+        return value
+
+    def __readonly(self, *args, **kwargs):
+        raise TypeError("'FrozenStorage' object does not support mutation")
+
+    __setattr__ = __setitem__ = __delattr__ = __delitem__ = __readonly
+    clear = pop = popitem = setdefault = update = __ior__ = __readonly
+
+    def __reduce__(self):
+        return (FrozenStorage, (dict(self),))
+
+    def __repr__(self):
+        return '<FrozenStorage %s>' % dict.__repr__(self)
+
+    def derive(self, *args, **kwargs):
+        """
+        Returns a new FrozenStorage with elements updated from the provided
+        dict and keyword arguments, which are frozen as by `make`. Unchanged
+        values, nested FrozenStorage objects inclusive, are shared with this
+        object rather than copied.
+        """
+        items = dict(self)
+        changes = dict(*args, **kwargs)
+        items.update((k, FrozenStorage._freeze(v)) for k, v in changes.items())
+        return FrozenStorage(items)
+
+    @staticmethod
+    def make(obj):
+        """
+        Converts a dict or storage object into a FrozenStorage object in one
+        pass. Nested dict-like elements become FrozenStorage objects while
+        lists and tuples become tuples and sets become frozensets.
+        """
+        if not isinstance(obj, (dict,)):
+            raise ValueError('obj must be a dict or dict-like object')
+        return FrozenStorage._freeze(obj)
+
+    @staticmethod
+    def _freeze(value):
+        if isinstance(value, FrozenStorage):
+            return value
+        if isinstance(value, dict):
+            return FrozenStorage({
+                k: FrozenStorage._freeze(v) for k, v in value.items()
+            })
+        if isinstance(value, (list, tuple)):
+            return tuple(FrozenStorage._freeze(v) for v in value)
+        if isinstance(value, set):
+            return frozenset(value)
+        return value
+
+
 class CommandError(Exception):
     """The exception thrown for a command related error."""
     pass
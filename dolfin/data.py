@@ -3,19 +3,300 @@
 Defines functions and classes for data access operations.
 """
 import os
-from abc import ABCMeta, abstractmethod
+import json
+import time
+import hashlib
+import tempfile
+import threading
+import weakref
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+from abc import ABCMeta
 from .core import Storage
 
 
 
+class DbErrorSink:
+    """
+    Represents a bounded collector for errors raised while processing DML
+    statements. The first `max_errors` errors are kept in memory summarized
+    as `Storage` objects (error class name, message and dml) so exceptions
+    and their tracebacks are released; the rest are appended to a local file
+    as JSON lines. Counts by error class are kept for all errors.
+
+    When no filepath is given, errors are spilled to a temporary file which
+    the sink owns and removes on `discard` or once garbage collected.
+    """
+    max_errors = 100
+
+    def __init__(self, filepath=None, max_errors=None):
+        self.filepath = filepath
+        self.max_errors = (
+            DbErrorSink.max_errors if max_errors is None else max_errors
+        )
+        self.errors = []
+        self.counts = {}
+        self.count = 0
+        self.__file = None
+        self.__offset = None
+        self.__remover = None
+
+    @property
+    def spilled(self):
+        return self.count - len(self.errors)
+
+    def add(self, ex, dml):
+        name = type(ex).__name__
+        self.counts[name] = self.counts.get(name, 0) + 1
+        self.count += 1
+
+        error = Storage(error=name, message=str(ex), dml=dml)
+        if len(self.errors) < self.max_errors:
+            self.errors.append(error)
+        else:
+            self.__get_file().write(json.dumps(error, default=str) + '\n')
+
+    def read_spilled(self):
+        """
+        Returns a generator over errors written to the spill file by this
+        sink, skipping content the file held beforehand.
+        """
+        if not self.spilled:
+            return
+        if self.__file:
+            self.__file.flush()
+        with open(self.filepath, 'rb') as f:
+            f.seek(self.__offset)
+            for line in f:
+                yield Storage(json.loads(line.decode('utf-8')))
+
+    def close(self):
+        if self.__file:
+            self.__file.close()
+            self.__file = None
+
+    def discard(self):
+        """
+        Closes the spill file and removes it if owned by the sink.
+        """
+        self.close()
+        if self.__remover:
+            self.__remover()
+
+    def __get_file(self):
+        if self.__file is None:
+            if not self.filepath:
+                handle, self.filepath = tempfile.mkstemp(
+                    prefix='dolfin-errors-', suffix='.jsonl'
+                )
+                os.close(handle)
+                self.__remover = weakref.finalize(
+                    self, DbErrorSink._remove, self.filepath)
+            self.__file = open(self.filepath, 'a', encoding='utf-8')
+            if self.__offset is None:
+                self.__offset = self.__file.tell()
+        return self.__file
+
+    @staticmethod
+    def _remove(filepath):
+        try:
+            os.remove(filepath)
+        except OSError:
+            pass
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        yield from self.errors
+        yield from self.read_spilled()
+
+
+class DbPoolError(Exception):
+    """The exception thrown for a connection pool related error."""
+    pass
+
+
+class DbConnectionPool:
+    """
+    Represents a thread-safe pool of DB-API connections created by `factory`.
+
+    Between `min_size` and `max_size` connections are kept open; connections
+    idle for over `idle_timeout` seconds are closed down to `min_size`. An
+    idle connection is checked with `health_check` before being handed out
+    and replaced when found unusable. The pool can be passed to the `Db`
+    helpers in place of a connection; note that a row provider consumed by
+    `Db.process` holds a connection of its own while the process holds
+    another.
+    """
+
+    def __init__(self, factory, min_size=0, max_size=10, idle_timeout=300,
+        health_check=None):
+        if not callable(factory):
+            raise ValueError("factory must be callable")
+        if max_size < 1 or min_size > max_size:
+            raise ValueError(
+                "expected: 0 <= min_size <= max_size and max_size >= 1"
+            )
+
+        self.factory = factory
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check = health_check or DbConnectionPool._check_health
+        self.closed = False
+        self.__cond = threading.Condition()
+        self.__idle = deque()
+        self.__in_use = set()
+        self.__size = 0
+
+        for i in range(min_size):
+            self.__idle.append((factory(), time.monotonic()))
+            self.__size += 1
+
+    @property
+    def size(self):
+        return self.__size
+
+    @property
+    def idle_count(self):
+        return len(self.__idle)
+
+    @property
+    def in_use_count(self):
+        return len(self.__in_use)
+
+    def acquire(self, timeout=None):
+        """
+        Checks out a connection, waiting up to timeout seconds (indefinitely
+        if None) for one to be released when max_size connections are in use.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.__cond:
+            while True:
+                if self.closed:
+                    raise DbPoolError("connection pool is closed")
+                self.__close_expired()
+                if self.__idle:
+                    conn = self.__idle.pop()[0]
+                    break
+                if self.__size < self.max_size:
+                    conn, self.__size = (None, self.__size + 1)
+                    break
+
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise DbPoolError(
+                            "timed out waiting for a connection"
+                        )
+                self.__cond.wait(remaining)
+
+        try:
+            if conn is not None and not self.health_check(conn):
+                DbConnectionPool._close(conn)
+                conn = None
+            if conn is None:
+                conn = self.factory()
+        except:
+            with self.__cond:
+                self.__size -= 1
+                self.__cond.notify()
+            raise
+
+        with self.__cond:
+            self.__in_use.add(conn)
+        return conn
+
+    def release(self, conn):
+        """
+        Returns a connection to the pool, rolling back any open transaction.
+        """
+        with self.__cond:
+            if conn not in self.__in_use:
+                raise ValueError("connection not checked out from this pool")
+
+        try:
+            conn.rollback()
+            reusable = not self.closed
+        except Exception:
+            reusable = False
+
+        with self.__cond:
+            self.__in_use.remove(conn)
+            if reusable and not self.closed:
+                self.__idle.append((conn, time.monotonic()))
+            else:
+                DbConnectionPool._close(conn)
+                self.__size -= 1
+            self.__cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """
+        Closes idle connections; connections in use are closed on release.
+        """
+        with self.__cond:
+            self.closed = True
+            while self.__idle:
+                DbConnectionPool._close(self.__idle.pop()[0])
+                self.__size -= 1
+            self.__cond.notify_all()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __close_expired(self):
+        # idle connections are appended on release, oldest are on the left
+        expires = time.monotonic() - self.idle_timeout
+        while (self.__idle and self.__size > self.min_size and
+                self.__idle[0][1] < expires):
+            DbConnectionPool._close(self.__idle.popleft()[0])
+            self.__size -= 1
+
+    @staticmethod
+    def _check_health(conn):
+        try:
+            conn.cursor().execute('SELECT 1')
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
 class Db:
 
     @staticmethod
-    def make_dml_provider(dml_builder, row_provider):
+    def make_dml_provider(dml_builder, row_provider, context=None):
+        """
+        Returns a dml provider for `Db.process` built by calling dml_builder
+        for each row. When context (e.g. a Storage of `DbLookup` objects) is
+        provided, dml_builder is called as `dml_builder(row, context)`.
+        """
         def dml_provider():
             for row in row_provider:
                 try:
-                    dml = dml_builder(row)
+                    if context is None:
+                        dml = dml_builder(row)
+                    else:
+                        dml = dml_builder(row, context)
                     yield dml
                 except Exception as ex:
                     raise ex
@@ -23,7 +304,17 @@ class Db:
     
     @staticmethod
     def make_row_provider(conn, table_name, columns=None, 
-        extra_clause=None, count=None):
+        extra_clause=None, count=None, batch_size=None):
+        """
+        Returns a generator over rows of table_name as Storage objects. Up to
+        count rows are read when given, otherwise all rows are read at once
+        or, when batch_size is given, in batches of batch_size rows.
+
+        Given a `DbConnectionPool`, a connection is checked out on the first
+        row and held until the rows are exhausted or the generator is closed.
+        A provider consumed within `Db.process` on the same pool thus needs
+        the pool's max_size to be at least 2.
+        """
         # build query text
         query = "SELECT %s FROM %s" % (
             '*' if not columns else ', '.join(columns),
@@ -34,23 +325,144 @@ class Db:
             query += extra_clause
         
         def read_rows():
+            if isinstance(conn, DbConnectionPool):
+                # released once rows are exhausted or the generator is closed
+                with conn.connection() as c:
+                    yield from Db.make_row_provider(
+                        c, table_name, columns, extra_clause, count,
+                        batch_size)
+                return
+
             # execute query
             cursor = conn.cursor()
-            cursor.execute()
+            cursor.execute(query)
 
             desc = cursor.description
             fields = [f[0] for f in desc]
 
-            records = cursor.fetchmany(count) if count else cursor.fetchall()
-            for r in records:
-                yield _(zip(fields, r))
+            if count or not batch_size:
+                records = (
+                    cursor.fetchmany(count) if count else cursor.fetchall()
+                )
+                for r in records:
+                    yield Storage(zip(fields, r))
+                return
+
+            records = cursor.fetchmany(batch_size)
+            while records:
+                for r in records:
+                    yield Storage(zip(fields, r))
+                records = cursor.fetchmany(batch_size)
         return read_rows()
 
     @staticmethod
-    def process(self, conn, dml_provider, commit_interval=10,
-        on_dml_processed=None):
+    def make_fingerprints(row_provider, key_columns, columns=None,
+        digest_size=8):
+        """
+        Returns a dict mapping the key (a tuple of key_columns values) of each
+        row to a compact digest of its values. Values of columns are hashed
+        in the given order, or of all columns in name order if not given, so
+        the column order of the underlying table does not matter.
+        """
+        fingerprints, blake2b = ({}, hashlib.blake2b)
+        for row in row_provider:
+            if not fingerprints and any(c not in row for c in key_columns):
+                raise ValueError(
+                    "rows lack key columns: %s" % ', '.join(key_columns))
+            key = tuple(row[c] for c in key_columns)
+            names = columns or sorted(row.keys())
+            data = repr(tuple(row[c] for c in names)).encode('utf-8')
+            fingerprints[key] = blake2b(data, digest_size=digest_size).digest()
+        return fingerprints
+
+    @staticmethod
+    def diff_fingerprints(source, target):
+        """
+        Compares source and target fingerprints and returns a Storage with
+        sets of keys to be inserted, updated and deleted on the target.
+        """
+        changes = Storage(inserts=set(), updates=set(), deletes=set())
+        for key, digest in source.items():
+            found = target.get(key)
+            if found is None:
+                changes.inserts.add(key)
+            elif found != digest:
+                changes.updates.add(key)
+        
+        changes.deletes.update(k for k in target if k not in source)
+        return changes
+
+    @staticmethod
+    def make_delta_dml_provider(dml_builder, source_conn, target_conn,
+        table_name, key_columns, columns=None, target_table_name=None,
+        batch_size=1000):
+        """
+        Returns a dml provider for `Db.process` which yields statements only
+        for rows that differ between the source and target tables. Tables are
+        read in batches of batch_size rows, thus only the fingerprints and
+        changed rows are held in memory.
+
+        Key columns are read along with columns when left out of them.
+        Changes are found when the provider is made, with pooled connections
+        released afterwards, and are available as `changes` on the provider.
+        dml_builder is called as `dml_builder(action, row)` where action is
+        one of 'insert', 'update' or 'delete'. Deleted rows are presented
+        with just their key columns.
+        """
+        target_table_name = target_table_name or table_name
+        selected = columns and list(key_columns) + [
+            c for c in columns if c not in key_columns]
+
+        def read_rows(conn, name):
+            if isinstance(conn, DbConnectionPool):
+                with conn.connection() as c:
+                    yield from read_rows(c, name)
+                return
+            yield from Db.make_row_provider(
+                conn, name, selected, batch_size=batch_size)
+
+        fingerprint = lambda conn, name: Db.make_fingerprints(
+            read_rows(conn, name), key_columns, columns
+        )
+        changes = Db.diff_fingerprints(
+            fingerprint(source_conn, table_name),
+            fingerprint(target_conn, target_table_name)
+        )
+
+        changed = []
+        if changes.inserts or changes.updates:
+            for row in read_rows(source_conn, table_name):
+                key = tuple(row[c] for c in key_columns)
+                if key in changes.inserts:
+                    changed.append(('insert', row))
+                elif key in changes.updates:
+                    changed.append(('update', row))
+        
+        def dml_provider():
+            for action, row in changed:
+                yield dml_builder(action, row)
+            for key in changes.deletes:
+                yield dml_builder('delete', Storage(zip(key_columns, key)))
+        
+        dml_provider.changes = changes
+        return dml_provider
+
+    @staticmethod
+    def process(conn, dml_provider, commit_interval=10,
+        on_dml_processed=None, error_sink=None):
+        """
+        Executes the DML statements from dml_provider, committing every
+        commit_interval statements. Failures are collected by error_sink
+        which is a `DbErrorSink` bounded with default settings when not
+        provided and is returned as `errors` on the results.
+        """
         if not dml_provider:
             raise ValueError("dml_provider must be provided.")
+
+        if isinstance(conn, DbConnectionPool):
+            with conn.connection() as c:
+                return Db.process(c, dml_provider, commit_interval,
+                    on_dml_processed, error_sink)
         
         if not on_dml_processed:
             def on_process(dml, passed, count):
@@ -61,37 +473,168 @@ class Db:
             on_dml_processed = on_process
         
         # storage for operation results summary
-        results = _(failed=0, passed=0, errors=[])
-        count, cursor = (0, conn.corsor())
-        for dml in dml_provider():
-            try:
-                cursor.execute(dml)
-                results.passed += 1
-                passed = True
-            except Exception as ex:
-                results.errors.append([ex, dml])
-                results.failed += 1
-                passed = False
-            
-            count += 1
-            if count % commit_interval == 0:
-                conn.commit()
+        errors = error_sink if error_sink is not None else DbErrorSink()
+        results = Storage(failed=0, passed=0, errors=errors)
+        count, cursor = (0, conn.cursor())
+        try:
+            for dml in dml_provider():
+                try:
+                    cursor.execute(dml)
+                    results.passed += 1
+                    passed = True
+                except Exception as ex:
+                    errors.add(ex, dml)
+                    results.failed += 1
+                    passed = False
+                
+                count += 1
+                if count % commit_interval == 0:
+                    conn.commit()
+                
+                on_dml_processed(dml, passed, count)
             
-            on_dml_processed(dml, passed, count)
-        
-        # commit orphaned transactions
-        conn.commit()
+            # commit orphaned transactions
+            conn.commit()
+        finally:
+            errors.close()
 
         # return 
         return results
 
 
+class DbLookup:
+    """
+    Represents an in-memory key to value index over a reference table, loaded
+    once using `Db.make_row_provider`. Keys are values of key_columns (tuples
+    for composite keys) and values are values of value_columns (tuples when
+    more than one). Rows can be filtered with a `where` condition.
+
+    When max_size is given and the table holds more rows, only max_size
+    entries are kept and evicted least recently used first; lookups missing
+    from the index fall back to a query using the `placeholder` parameter
+    marker of the DB-API driver.
+    """
+    # marks keys known to be absent from the table in a bounded index
+    __missing = object()
+    
+    def __init__(self, conn, table_name, key_columns, value_columns,
+        max_size=None, where=None, placeholder='?'):
+        if not key_columns or not value_columns:
+            raise ValueError("key_columns and value_columns must be provided")
+        if max_size is not None and max_size < 1:
+            raise ValueError("max_size must be greater than zero")
+
+        self.conn = conn
+        self.table_name = table_name
+        self.key_columns = tuple(key_columns)
+        self.value_columns = tuple(value_columns)
+        self.max_size = max_size
+        self.where = where
+        self.placeholder = placeholder
+        self.bounded = False
+        self.hits = self.misses = 0
+        self.__index = self.__load()
+
+    def __load(self):
+        make_key = self.__make_getter(self.key_columns)
+        make_value = self.__make_getter(self.value_columns)
+        rows = Db.make_row_provider(
+            self.conn, self.table_name, self.key_columns + self.value_columns,
+            extra_clause=' WHERE %s' % self.where if self.where else None,
+            count=self.max_size + 1 if self.max_size else None
+        )
+
+        index, fetched = ({}, 0)
+        for row in rows:
+            index[make_key(row)] = make_value(row)
+            fetched += 1
+
+        # rows past max_size exist when more were fetched, even if their
+        # keys repeat those already loaded
+        if self.max_size is not None and fetched > self.max_size:
+            self.bounded = True
+            index = OrderedDict(index)
+            while len(index) > self.max_size:
+                index.popitem()
+        return index
+
+    @staticmethod
+    def __make_getter(columns):
+        if len(columns) == 1:
+            column = columns[0]
+            return lambda row: row[column]
+        return lambda row: tuple(row[c] for c in columns)
+
+    def __len__(self):
+        return len(self.__index)
+
+    def __contains__(self, key):
+        return self.get(key, DbLookup.__missing) is not DbLookup.__missing
+
+    def __getitem__(self, key):
+        value = self.get(key, DbLookup.__missing)
+        if value is DbLookup.__missing:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        index = self.__index
+        if key in index:
+            self.hits += 1
+            if self.bounded:
+                index.move_to_end(key)
+            value = index[key]
+        elif not self.bounded:
+            return default
+        else:
+            self.misses += 1
+            value = index[key] = self.__query(key)
+            if len(index) > self.max_size:
+                index.popitem(last=False)
+        return default if value is DbLookup.__missing else value
+
+    def __query(self, key):
+        query = "SELECT %s FROM %s WHERE %s" % (
+            ', '.join(self.value_columns), self.table_name,
+            ' AND '.join('%s = %s' % (c, self.placeholder)
+                         for c in self.key_columns)
+        )
+        if self.where:
+            query += ' AND (%s)' % self.where
+        params = key if len(self.key_columns) > 1 else (key,)
+
+        def fetch(conn):
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            return cursor.fetchone()
+
+        if isinstance(self.conn, DbConnectionPool):
+            with self.conn.connection() as conn:
+                record = fetch(conn)
+        else:
+            record = fetch(self.conn)
+
+        if record is None:
+            return DbLookup.__missing
+        return record[0] if len(self.value_columns) == 1 else tuple(record)
+
+
 class XlSheet:
     """
     Represents a light wrapper around openpyxl's Worksheet object. Provides
     convenient ways of iterating over rows which are presented as tuples.
+
+    Iteration is bounded by the detected data extent rather than the reported
+    sheet dimensions, which formatting often inflates far past the data. The
+    extent is exact when the worksheet keeps its populated cells (as loaded
+    workbooks do). Otherwise it is estimated: rows past `max_empty_rows`
+    consecutive empty ones and columns past the last value in the first
+    `column_sample_rows` rows are taken to be outside the data, thus data
+    beyond a long gap or first appearing lower down can be missed.
     """
     max_row_check = 10
+    max_empty_rows = 100
+    column_sample_rows = 100
     
     def __init__(self, source, sheet_name, row_offset=0, col_offset=0):
         # burying import here scopes dependency on openpyxl to just XlSheet
@@ -123,6 +666,8 @@ class XlSheet:
         self.__row_offset = row_offset
         self.__generator = None
         self.__current = None
+        self.__data_max_row = None
+        self.__data_max_column = None
     
     @property
     def current(self):
@@ -136,6 +681,20 @@ class XlSheet:
     def max_row(self):
         return self.worksheet.max_row
     
+    @property
+    def data_max_column(self):
+        """The index of the last column with data."""
+        if self.__data_max_column is None:
+            self.__detect_extent()
+        return self.__data_max_column
+
+    @property
+    def data_max_row(self):
+        """The index of the last row with data."""
+        if self.__data_max_row is None:
+            self.__detect_extent()
+        return self.__data_max_row
+    
     @property
     def col_offset(self):
         return self.__col_offset
@@ -169,9 +728,10 @@ class XlSheet:
     
     def __get_generator(self):
         def make_generator():
-            for i in range(self.row_offset + 1, self.max_row + 1):
+            max_column = self.data_max_column
+            for i in range(self.row_offset + 1, self.data_max_row + 1):
                 row = []
-                for j in range(self.col_offset + 1, self.max_column + 1):
+                for j in range(self.col_offset + 1, max_column + 1):
                     value = self.worksheet.cell(row=i, column=j).value
                     row.append(value)
                 
@@ -182,6 +742,51 @@ class XlSheet:
             self.__generator = make_generator()
         return self.__generator
     
+    @staticmethod
+    def __is_empty_value(value):
+        return value is None or value == ''
+
+    def __detect_extent(self):
+        cells = getattr(self.worksheet, '_cells', None)
+        if cells is None:
+            self.__data_max_column = self.__estimate_max_column()
+            self.__data_max_row = self.__estimate_max_row()
+            return
+
+        # a single pass over populated cells gives the exact extent
+        max_row = max_column = 0
+        for (row, column), cell in cells.items():
+            if not self.__is_empty_value(cell.value):
+                max_row = max(max_row, row)
+                max_column = max(max_column, column)
+        self.__data_max_row, self.__data_max_column = (max_row, max_column)
+
+    def __estimate_max_column(self):
+        last, sample_end = (0, min(self.max_row, self.column_sample_rows))
+        rows = self.worksheet.iter_rows(
+            min_row=1, max_row=sample_end, values_only=True)
+        for row in rows:
+            for j in range(len(row), last, -1):
+                if not self.__is_empty_value(row[j - 1]):
+                    last = j
+                    break
+        return last
+
+    def __estimate_max_row(self):
+        max_column, last, empty = (self.__data_max_column, 0, 0)
+        for i in range(1, self.max_row + 1):
+            values = (
+                self.worksheet.cell(row=i, column=j).value
+                    for j in range(1, max_column + 1)
+            )
+            if all(self.__is_empty_value(v) for v in values):
+                empty += 1
+                if empty > self.max_empty_rows:
+                    break
+            else:
+                last, empty = (i, 0)
+        return last
+    
     @staticmethod
     def find_headers(xlsheet, sample_headers, row_offset=0):
         norm_hdrs = [h.lower() for h in sample_headers]
@@ -200,20 +805,239 @@ class XlSheet:
                 return -1
 
 
+class XlColumn:
+    """
+    Describes a typed column read by a `TypedXlReaderBase`. A column is named,
+    positioned by `index` and its cell values are converted using `parser` or
+    `type`; empty cells resolve to `default` or are reported when `required`.
+    """
+
+    def __init__(self, name, type=None, default=None, required=False,
+        parser=None, index=None):
+        if not name:
+            raise ValueError("name cannot be null")
+        if parser is not None and not callable(parser):
+            raise ValueError("parser must be callable")
+        self.name = name
+        self.type = type
+        self.default = default
+        self.required = required
+        self.parser = parser
+        self.index = index
+
+    def __repr__(self):
+        return '<XlColumn %s>' % self.name
+
+
+class XlSheetWriter:
+    """
+    Represents the writing counterpart of `XlSheet`. Streams rows presented as
+    tuples or dict-like objects (e.g. rows from `Db.make_row_provider`) to an
+    Excel file using openpyxl's write-only mode, thus memory use stays flat
+    regardless of the number of rows written.
+
+    A header row is written at the top of each sheet. Once a sheet holds
+    `max_rows` rows, writing continues on a new sheet.
+    """
+    max_rows = 1048576
+
+    def __init__(self, target, sheet_name='Sheet1', headers=None,
+        max_rows=None):
+        # burying import here scopes dependency on openpyxl to XlSheetWriter
+        import openpyxl
+
+        if not target:
+            raise ValueError("target cannot be null")
+
+        self.target = target
+        self.sheet_name = sheet_name
+        self.max_rows = max_rows or XlSheetWriter.max_rows
+        if self.max_rows < 2:
+            raise ValueError("max_rows must allow for headers and data")
+
+        self.workbook = openpyxl.Workbook(write_only=True)
+        self.__closed = False
+        self.__headers = None
+        self.__worksheet = None
+        self.__sheet_rows = 0
+        self.__row_count = 0
+        self.__sheet_count = 0
+        if headers:
+            self.headers = headers
+
+    @property
+    def headers(self):
+        """
+        The header names, which can be set directly or from a DB-API cursor
+        description. Defaults to the keys of the first dict-like row.
+        """
+        return self.__headers
+
+    @headers.setter
+    def headers(self, value):
+        if self.__worksheet is not None:
+            raise ValueError("headers cannot be changed once rows are written")
+        self.__headers = tuple(
+            h[0] if isinstance(h, (tuple, list)) else h for h in value
+        )
+
+    @property
+    def row_count(self):
+        return self.__row_count
+
+    @property
+    def sheet_count(self):
+        return self.__sheet_count
+
+    def write_row(self, row):
+        if isinstance(row, dict):
+            if self.__headers is None:
+                self.headers = row.keys()
+            row = [row.get(h) for h in self.__headers]
+
+        if self.__worksheet is None or self.__sheet_rows == self.max_rows:
+            self.__add_worksheet()
+
+        self.__worksheet.append(row)
+        self.__sheet_rows += 1
+        self.__row_count += 1
+
+    def write_rows(self, rows):
+        """
+        Writes all rows from the provided iterable and returns the number of
+        rows written.
+        """
+        count = 0
+        for row in rows:
+            self.write_row(row)
+            count += 1
+        return count
+
+    def close(self):
+        """
+        Saves the workbook to the target. The writer cannot be used afterwards
+        and further calls do nothing.
+        """
+        if self.__closed:
+            return
+        if self.__worksheet is None:
+            self.__add_worksheet()
+        self.__closed = True
+        self.workbook.save(self.target)
+
+    def discard(self):
+        """
+        Drops the rows written without saving and removes the temporary files
+        which hold them. The writer cannot be used afterwards.
+        """
+        if self.__closed:
+            return
+        self.__closed = True
+        for worksheet in self.workbook.worksheets:
+            # write-only worksheets buffer rows in temporary files until saved
+            rows = getattr(worksheet, '_rows', None)
+            writer = getattr(worksheet, '_writer', None)
+            if rows is not None:
+                rows.close()
+            if writer is not None:
+                writer.close()
+                writer.cleanup()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def __add_worksheet(self):
+        if self.__closed:
+            raise ValueError("writer is closed")
+
+        # Excel limits sheet titles to 31 characters
+        self.__sheet_count += 1
+        title = self.sheet_name[:31]
+        if self.__sheet_count > 1:
+            suffix = ' (%s)' % self.__sheet_count
+            title = self.sheet_name[:31 - len(suffix)] + suffix
+
+        self.__worksheet = self.workbook.create_sheet(title)
+        self.__sheet_rows = 0
+        if self.__headers:
+            self.__worksheet.append(self.__headers)
+            self.__sheet_rows += 1
+
+
 class TypedXlReaderBase(metaclass=ABCMeta):
+    """
+    Represents the base class for readers which convert rows from an `XlSheet`
+    into `Storage` objects.
+
+    Derived classes either implement `get_rows` themselves or declare a
+    `schema`: a sequence of `XlColumn` objects which is compiled once into a
+    single row conversion function that `get_rows` applies to each row after
+    the `sample_headers` (when provided). Conversion errors are collected into
+    `errors` as `(row_number, column_name, message)` tuples. Derived classes
+    with neither cannot be instantiated.
+    """
+    schema = None
+    sample_headers = None
     
     def __init__(self, xlsheet):
+        if not self.schema and (
+                type(self).get_rows is TypedXlReaderBase.get_rows):
+            raise TypeError(
+                "Can't instantiate %s without a schema or get_rows" %
+                type(self).__name__
+            )
         if not xlsheet:
             raise ValueError("xlsheet cannot be null")
         self.xlsheet = xlsheet
+        self.errors = []
 
-    @abstractmethod
     def _get_column_name_index_map(self):
-        pass
+        if not self.schema:
+            raise NotImplementedError("schema or column map not defined")
+        return Storage(
+            (c.name, i if c.index is None else c.index)
+                for i, c in enumerate(self.schema)
+        )
         
-    @abstractmethod
     def get_rows(self):
-        pass
+        if not self.schema:
+            raise NotImplementedError("schema or get_rows not defined")
+
+        idx = self.xlsheet.row_offset
+        if self.sample_headers:
+            idx = self._ensure_headers_exists(self.sample_headers, idx)
+
+        convert = self._get_row_converter()
+        for row in self.xlsheet:
+            idx += 1
+            record, errors = convert(row)
+            if errors:
+                self.errors.extend((idx,) + e for e in errors)
+            yield record
+
+    def _get_row_converter(self):
+        """
+        Returns the conversion function compiled for the schema of the reader
+        class and the column index map of this reader. Compiled functions are
+        cached on the class for each distinct index map.
+        """
+        cls = type(self)
+        if '_row_converters' not in cls.__dict__:
+            cls._row_converters = {}
+
+        index_map = self._get_column_name_index_map()
+        key = (tuple(cls.schema), tuple(index_map.items()))
+        converter = cls._row_converters.get(key)
+        if converter is None:
+            converter = TypedXlReaderBase.compile_schema(cls.schema, index_map)
+            cls._row_converters[key] = converter
+        return converter
 
     def _ensure_headers_exists(self, sample_headers, row_offset=0):
         """
@@ -227,3 +1051,55 @@ class TypedXlReaderBase(metaclass=ABCMeta):
     
     def _get_data(self, row, key, default=''):
         return row[key] or default
+
+    @staticmethod
+    def compile_schema(columns, index_map=None):
+        """
+        Compiles a sequence of `XlColumn` objects into a function which takes
+        a row tuple and returns a `(Storage, errors)` pair, where errors is
+        None or a list of `(column_name, message)` tuples.
+
+        The generated function handles every column inline, thus a row costs
+        a single Python call rather than a few calls per cell.
+        """
+        if not columns:
+            raise ValueError("columns cannot be empty")
+
+        namespace = {'Storage': Storage}
+        lines = ['def convert(row):', '    n = len(row)', '    errors = None']
+        items = []
+        for i, col in enumerate(columns):
+            index = index_map[col.name] if index_map else (
+                i if col.index is None else col.index)
+            parser = col.parser or col.type
+            namespace['d%d' % i] = col.default
+            namespace['p%d' % i] = parser
+            namespace['t%d' % i] = col.type
+            namespace['c%d' % i] = col.name
+            items.append('c%d: v%d' % (i, i))
+
+            lines.append('    v%d = row[%d] if n > %d else None' % (
+                i, index, index))
+            lines.append("    if v%d is None or v%d == '':" % (i, i))
+            if col.required:
+                lines.append('        if errors is None: errors = []')
+                lines.append("        errors.append((c%d, 'value required'))"
+                    % i)
+            lines.append('        v%d = d%d' % (i, i))
+            if parser is not None:
+                cond = 'else:'
+                if col.parser is None:
+                    cond = 'elif not isinstance(v%d, t%d):' % (i, i)
+                lines.append('    ' + cond)
+                lines.append('        try:')
+                lines.append('            v%d = p%d(v%d)' % (i, i, i))
+                lines.append('        except Exception as ex:')
+                lines.append('            if errors is None: errors = []')
+                lines.append(
+                    "            errors.append((c%d, '%%s: %%s' %% "
+                    "(type(ex).__name__, ex)))" % i)
+                lines.append('            v%d = d%d' % (i, i))
+        lines.append('    return Storage({%s}), errors' % ', '.join(items))
+
+        exec('\n'.join(lines), namespace)
+        return namespace['convert']
@@ -66,6 +66,81 @@ class StorageTest(unittest.TestCase):
         self.assertIsInstance(obj.baz.meta, dolfin.Storage)
 
 
+class FrozenStorageTest(unittest.TestCase):
+
+    def test_frozen_storage_is_instance_of_storage(self):
+        foo = dolfin.FrozenStorage(bar='baz')
+        self.assertIsInstance(foo, dolfin.Storage)
+        self.assertEqual('baz', foo.bar)
+        self.assertIsNone(foo.qux)
+
+    def test_cannot_be_mutated(self):
+        foo = dolfin.FrozenStorage(bar='baz')
+        with self.assertRaises(TypeError):
+            foo.bar = 'qux'
+        with self.assertRaises(TypeError):
+            foo['bar'] = 'qux'
+        with self.assertRaises(TypeError):
+            del foo['bar']
+        with self.assertRaises(TypeError):
+            foo.update(bar='qux')
+        self.assertEqual('baz', foo.bar)
+
+    def test_equal_objects_have_equal_hashes(self):
+        foo = dolfin.FrozenStorage(bar='baz', qux=1)
+        norf = dolfin.FrozenStorage(qux=1, bar='baz')
+        self.assertEqual(hash(foo), hash(norf))
+        self.assertEqual(1, len({foo, norf}))
+
+    def test_can_be_used_as_lru_cache_key(self):
+        from functools import lru_cache
+
+        calls = []
+        @lru_cache(maxsize=None)
+        def lookup(conf):
+            calls.append(conf)
+            return conf.bar
+        
+        lookup(dolfin.FrozenStorage(bar='baz'))
+        lookup(dolfin.FrozenStorage(bar='baz'))
+        self.assertEqual(1, len(calls))
+
+    def test_can_make_from_storage_make_output(self):
+        obj = dolfin.Storage.make(dict(
+            baz = dict(quux = 'norf', tags = ['a', 'b'])
+        ))
+        frozen = dolfin.FrozenStorage.make(obj)
+        self.assertIsInstance(frozen.baz, dolfin.FrozenStorage)
+        self.assertEqual(('a', 'b'), frozen.baz.tags)
+        self.assertIsNotNone(hash(frozen))
+
+    def test_make_freezes_dicts_nested_in_tuples(self):
+        frozen = dolfin.FrozenStorage.make({'a': ({'b': 1},)})
+        self.assertIsInstance(frozen.a[0], dolfin.FrozenStorage)
+        self.assertIsNotNone(hash(frozen))
+
+    def test_derive_shares_unchanged_values(self):
+        foo = dolfin.FrozenStorage.make(dict(bar='baz', meta=dict(qux=1)))
+        norf = foo.derive(bar='quux')
+        self.assertEqual('baz', foo.bar)
+        self.assertEqual('quux', norf.bar)
+        self.assertIs(foo.meta, norf.meta)
+
+    def test_derive_freezes_new_values(self):
+        foo = dolfin.FrozenStorage.make({'a': 1}).derive(b={'c': [1]})
+        self.assertIsInstance(foo.b, dolfin.FrozenStorage)
+        self.assertEqual((1,), foo.b.c)
+        self.assertIsNotNone(hash(foo))
+
+    def test_can_be_pickled_and_unpickled(self):
+        import pickle
+
+        foo = dolfin.FrozenStorage(bar='baz')
+        qux = pickle.loads(pickle.dumps(foo))
+        self.assertIsInstance(qux, dolfin.FrozenStorage)
+        self.assertEqual(foo, qux)
+
+
 class FakeCommand(dolfin.Command):
     
     prog = 'fake'
@@ -1,9 +1,14 @@
 import os
+import sqlite3
+import tempfile
+import threading
 import unittest
 import openpyxl
 
 from dolfin import Storage as _
-from dolfin.data import XlSheet, TypedXlReaderBase
+from dolfin.data import Db, DbErrorSink, DbConnectionPool, DbPoolError, \
+     DbLookup, XlSheet, XlSheetWriter, XlColumn, \
+     TypedXlReaderBase
 
 
 
@@ -28,6 +33,421 @@ class StudentReader(TypedXlReaderBase):
             yield student
 
 
+class SchemaStudentReader(TypedXlReaderBase):
+    sample_headers = ('sn', 'name')
+    schema = (
+        XlColumn('sn', int, required=True),
+        XlColumn('name', str, required=True),
+        XlColumn('gender', parser=lambda v: v.upper(), default='U'),
+        XlColumn('age', int),
+    )
+
+
+class DbProcessTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.execute('CREATE TABLE people (id INTEGER PRIMARY KEY)')
+        handle, self.filepath = tempfile.mkstemp(suffix='.jsonl')
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.filepath)
+
+    def _process(self, ids, error_sink=None):
+        dml_provider = Db.make_dml_provider(
+            lambda i: 'INSERT INTO people VALUES (%s)' % i, ids
+        )
+        return Db.process(
+            self.conn, dml_provider, on_dml_processed=lambda *a: None,
+            error_sink=error_sink
+        )
+
+    def test_process_executes_dml_and_collects_errors(self):
+        results = self._process([1, 2, 2, 'x'])
+        self.assertEqual(2, results.passed)
+        self.assertEqual(2, results.failed)
+        self.assertIsInstance(results.errors, DbErrorSink)
+        self.assertEqual(2, len(results.errors.errors))
+        self.assertEqual('IntegrityError', results.errors.errors[0].error)
+        self.assertEqual({'IntegrityError': 1, 'OperationalError': 1},
+            results.errors.counts)
+
+    def test_errors_past_limit_are_spilled_to_file(self):
+        sink = DbErrorSink(self.filepath, max_errors=2)
+        results = self._process([1] * 6, sink)
+        self.assertEqual(5, results.failed)
+        self.assertEqual(5, len(sink))
+        self.assertEqual(2, len(sink.errors))
+        self.assertEqual(3, sink.spilled)
+        self.assertEqual({'IntegrityError': 5}, sink.counts)
+
+        spilled = list(sink.read_spilled())
+        self.assertEqual(3, len(spilled))
+        self.assertEqual('INSERT INTO people VALUES (1)', spilled[0].dml)
+        self.assertEqual(len(sink), len(list(sink)))
+
+    def test_spilled_errors_skip_existing_file_content(self):
+        with open(self.filepath, 'w') as f:
+            f.write('{"error": "Stale"}\n')
+        sink = DbErrorSink(self.filepath, max_errors=0)
+        self._process([1, 1], sink)
+        spilled = list(sink.read_spilled())
+        self.assertEqual(['IntegrityError'], [e.error for e in spilled])
+
+    def test_owned_spill_file_is_removed_on_discard(self):
+        sink = DbErrorSink(max_errors=0)
+        self._process([1, 1], sink)
+        self.assertTrue(os.path.isfile(sink.filepath))
+        sink.discard()
+        self.assertFalse(os.path.isfile(sink.filepath))
+
+    def test_spill_file_is_closed_when_dml_builder_raises(self):
+        sink = DbErrorSink(self.filepath, max_errors=0)
+        def build(i):
+            if i == 3:
+                raise RuntimeError('bad row')
+            return 'INSERT INTO people VALUES (1)'
+
+        with self.assertRaises(RuntimeError):
+            Db.process(
+                self.conn, Db.make_dml_provider(build, range(4)),
+                on_dml_processed=lambda *a: None, error_sink=sink
+            )
+        self.assertIsNone(sink._DbErrorSink__file)
+
+    def test_errors_kept_in_memory_hold_no_exceptions(self):
+        results = self._process([1, 1])
+        error = results.errors.errors[0]
+        self.assertFalse(any(isinstance(v, Exception) for v in error.values()))
+
+
+class DbDeltaSyncTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.source, self.target = (
+            sqlite3.connect(':memory:'), sqlite3.connect(':memory:')
+        )
+        for conn in (self.source, self.target):
+            conn.execute('CREATE TABLE people (id INTEGER PRIMARY KEY, '
+                'name TEXT)')
+            conn.executemany('INSERT INTO people VALUES (?, ?)', [
+                (i, 'name-%s' % i) for i in range(1, 6)
+            ])
+        self.source.execute("UPDATE people SET name='changed' WHERE id=2")
+        self.source.execute("DELETE FROM people WHERE id=4")
+        self.source.execute("INSERT INTO people VALUES (6, 'name-6')")
+
+    def _build_dml(self, action, row):
+        if action == 'insert':
+            return "INSERT INTO people VALUES (%s, '%s')" % (row.id, row.name)
+        if action == 'update':
+            return "UPDATE people SET name='%s' WHERE id=%s" % (
+                row.name, row.id)
+        return "DELETE FROM people WHERE id=%s" % row.id
+
+    def _read(self, conn):
+        return conn.execute('SELECT * FROM people ORDER BY id').fetchall()
+
+    def test_diff_fingerprints_detects_changes(self):
+        changes = Db.diff_fingerprints(
+            Db.make_fingerprints(
+                Db.make_row_provider(self.source, 'people'), ['id']),
+            Db.make_fingerprints(
+                Db.make_row_provider(self.target, 'people'), ['id'])
+        )
+        self.assertEqual({(6,)}, changes.inserts)
+        self.assertEqual({(2,)}, changes.updates)
+        self.assertEqual({(4,)}, changes.deletes)
+
+    def test_delta_sync_processes_only_changes(self):
+        dml_provider = Db.make_delta_dml_provider(
+            self._build_dml, self.source, self.target, 'people', ['id']
+        )
+        results = Db.process(
+            self.target, dml_provider, on_dml_processed=lambda *a: None
+        )
+        self.assertEqual(3, results.passed)
+        self.assertEqual(0, results.failed)
+        self.assertEqual(self._read(self.source), self._read(self.target))
+
+    def test_fingerprints_ignore_column_order(self):
+        self.target.execute('CREATE TABLE swapped (name TEXT, '
+            'id INTEGER PRIMARY KEY)')
+        self.target.execute('INSERT INTO swapped SELECT name, id FROM people')
+        changes = Db.diff_fingerprints(
+            Db.make_fingerprints(
+                Db.make_row_provider(self.target, 'people'), ['id']),
+            Db.make_fingerprints(
+                Db.make_row_provider(self.target, 'swapped'), ['id'])
+        )
+        self.assertFalse(changes.inserts or changes.updates or changes.deletes)
+
+    def test_delta_sync_reads_key_columns_left_out_of_columns(self):
+        dml_provider = Db.make_delta_dml_provider(
+            self._build_dml, self.source, self.target, 'people', ['id'],
+            columns=['name']
+        )
+        self.assertEqual({(6,)}, dml_provider.changes.inserts)
+        self.assertEqual({(2,)}, dml_provider.changes.updates)
+        self.assertEqual({(4,)}, dml_provider.changes.deletes)
+        self.assertIn("UPDATE people SET name='changed' WHERE id=2",
+            list(dml_provider()))
+
+    def test_fingerprints_of_rows_without_key_columns_raise(self):
+        rows = Db.make_row_provider(self.source, 'people', ['name'])
+        with self.assertRaises(ValueError):
+            Db.make_fingerprints(rows, ['id'])
+
+    def test_row_provider_can_read_in_batches(self):
+        rows = Db.make_row_provider(self.source, 'people', batch_size=2)
+        self.assertEqual([1, 2, 3, 5, 6], [r.id for r in rows])
+
+    def test_delta_sync_of_equal_tables_yields_nothing(self):
+        dml_provider = Db.make_delta_dml_provider(
+            self._build_dml, self.target, self.target, 'people', ['id']
+        )
+        self.assertEqual([], list(dml_provider()))
+
+
+class DbConnectionPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.filepath = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.connects = []
+
+    def tearDown(self):
+        os.remove(self.filepath)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.filepath, check_same_thread=False)
+        self.connects.append(conn)
+        return conn
+
+    def test_connections_are_reused(self):
+        with DbConnectionPool(self._connect, max_size=2) as pool:
+            with pool.connection() as conn:
+                first = conn
+            with pool.connection() as conn:
+                self.assertIs(first, conn)
+        self.assertEqual(1, len(self.connects))
+
+    def test_creates_min_size_connections_upfront(self):
+        pool = DbConnectionPool(self._connect, min_size=2, max_size=3)
+        self.assertEqual(2, pool.size)
+        self.assertEqual(2, pool.idle_count)
+        pool.close()
+        self.assertEqual(0, pool.size)
+
+    def test_acquire_times_out_at_max_size(self):
+        pool = DbConnectionPool(self._connect, max_size=1)
+        conn = pool.acquire()
+        with self.assertRaises(DbPoolError):
+            pool.acquire(timeout=0.01)
+        pool.release(conn)
+        pool.release(pool.acquire(timeout=0.01))
+
+    def test_concurrent_use_is_limited_to_max_size(self):
+        pool = DbConnectionPool(self._connect, max_size=3)
+        lock, active, peak = (threading.Lock(), [0], [0])
+
+        def work():
+            with pool.connection() as conn:
+                with lock:
+                    active[0] += 1
+                    peak[0] = max(peak[0], active[0])
+                conn.execute('SELECT 1').fetchall()
+                threading.Event().wait(0.01)
+                with lock:
+                    active[0] -= 1
+
+        threads = [threading.Thread(target=work) for i in range(12)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(3, peak[0])
+        self.assertLessEqual(len(self.connects), 3)
+        self.assertEqual(0, pool.in_use_count)
+
+    def test_unhealthy_connection_is_replaced(self):
+        pool = DbConnectionPool(self._connect, max_size=1)
+        with pool.connection() as conn:
+            first = conn
+        first.close()
+        with pool.connection() as conn:
+            self.assertIsNot(first, conn)
+            conn.execute('SELECT 1')
+        self.assertEqual(1, pool.size)
+
+    def test_idle_connections_expire(self):
+        pool = DbConnectionPool(self._connect, max_size=2, idle_timeout=0)
+        pool.release(pool.acquire())
+        self.assertEqual(1, pool.idle_count)
+        pool.release(pool.acquire())
+        self.assertEqual(2, len(self.connects))
+        self.assertEqual(1, pool.size)
+
+    def test_db_helpers_accept_pool(self):
+        pool = DbConnectionPool(self._connect, max_size=1)
+        with pool.connection() as conn:
+            conn.execute('CREATE TABLE people (id INTEGER PRIMARY KEY)')
+        dml_provider = Db.make_dml_provider(
+            lambda i: 'INSERT INTO people VALUES (%s)' % i, range(5)
+        )
+        results = Db.process(
+            pool, dml_provider, on_dml_processed=lambda *a: None
+        )
+        self.assertEqual(5, results.passed)
+        rows = list(Db.make_row_provider(pool, 'people'))
+        self.assertEqual(5, len(rows))
+        self.assertEqual(0, pool.in_use_count)
+        self.assertEqual(1, len(self.connects))
+
+    def test_row_provider_releases_pooled_connection(self):
+        pool = DbConnectionPool(self._connect, max_size=2)
+        with pool.connection() as conn:
+            conn.execute('CREATE TABLE src (id INTEGER)')
+            conn.executemany('INSERT INTO src VALUES (?)',
+                [(i,) for i in range(5)])
+            conn.commit()
+
+        rows = Db.make_row_provider(pool, 'src', batch_size=2)
+        self.assertEqual(0, pool.in_use_count)
+        next(rows)
+        self.assertEqual(1, pool.in_use_count)
+        rows.close()
+        self.assertEqual(0, pool.in_use_count)
+
+        self.assertEqual(5, len(list(
+            Db.make_row_provider(pool, 'src', batch_size=2))))
+        self.assertEqual(0, pool.in_use_count)
+
+    def test_pooled_row_provider_can_feed_process_on_same_pool(self):
+        pool = DbConnectionPool(self._connect, max_size=2)
+        with pool.connection() as conn:
+            conn.execute('CREATE TABLE src (id INTEGER)')
+            conn.execute('CREATE TABLE dst (id INTEGER)')
+            conn.executemany('INSERT INTO src VALUES (?)', [(1,), (2,)])
+            conn.commit()
+
+        dml_provider = Db.make_dml_provider(
+            lambda r: 'INSERT INTO dst VALUES (%s)' % r.id,
+            Db.make_row_provider(pool, 'src')
+        )
+        results = Db.process(
+            pool, dml_provider, on_dml_processed=lambda *a: None
+        )
+        self.assertEqual(2, results.passed)
+        self.assertEqual(0, pool.in_use_count)
+        self.assertEqual(2, len(self.connects))
+
+    def test_delta_sync_accepts_pools(self):
+        handle, target_path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.addCleanup(os.remove, target_path)
+        connect = lambda path: lambda: sqlite3.connect(
+            path, check_same_thread=False)
+        source = DbConnectionPool(connect(self.filepath), max_size=1)
+        target = DbConnectionPool(connect(target_path), max_size=1)
+        for pool, ids in ((source, (1, 2, 3)), (target, (2, 4))):
+            with pool.connection() as conn:
+                conn.execute('CREATE TABLE t (id INTEGER PRIMARY KEY)')
+                conn.executemany('INSERT INTO t VALUES (?)',
+                    [(i,) for i in ids])
+                conn.commit()
+
+        dml_provider = Db.make_delta_dml_provider(
+            lambda action, row: (
+                'DELETE FROM t WHERE id=%s' if action == 'delete' else
+                'INSERT INTO t VALUES (%s)') % row.id,
+            source, target, 't', ['id']
+        )
+        results = Db.process(
+            target, dml_provider, on_dml_processed=lambda *a: None
+        )
+        self.assertEqual(3, results.passed)
+        self.assertEqual([1, 2, 3],
+            sorted(r.id for r in Db.make_row_provider(target, 't')))
+
+
+class DbLookupTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.execute('CREATE TABLE states (id INTEGER PRIMARY KEY, '
+            'country TEXT, code TEXT, name TEXT)')
+        self.conn.executemany('INSERT INTO states VALUES (?, ?, ?, ?)', [
+            (1, 'NG', 'KN', 'Kano'), (2, 'NG', 'LA', 'Lagos'),
+            (3, 'GH', 'AS', 'Ashanti'), (4, 'NG', 'KD', 'Kaduna'),
+        ])
+
+    def test_can_lookup_values_by_key(self):
+        lookup = DbLookup(self.conn, 'states', ['code'], ['id'])
+        self.assertEqual(4, len(lookup))
+        self.assertEqual(2, lookup['LA'])
+        self.assertEqual(2, lookup.get('LA'))
+        self.assertIsNone(lookup.get('XX'))
+        self.assertNotIn('XX', lookup)
+        with self.assertRaises(KeyError):
+            lookup['XX']
+
+    def test_can_lookup_using_composite_keys_and_values(self):
+        lookup = DbLookup(
+            self.conn, 'states', ['country', 'code'], ['id', 'name'])
+        self.assertEqual((3, 'Ashanti'), lookup[('GH', 'AS')])
+        self.assertNotIn(('NG', 'AS'), lookup)
+
+    def test_can_filter_rows_loaded(self):
+        lookup = DbLookup(
+            self.conn, 'states', ['code'], ['id'], where="country = 'NG'")
+        self.assertEqual(3, len(lookup))
+        self.assertNotIn('AS', lookup)
+
+    def test_bounded_lookup_falls_back_to_query(self):
+        lookup = DbLookup(self.conn, 'states', ['code'], ['id'], max_size=2)
+        self.assertTrue(lookup.bounded)
+        self.assertEqual(2, len(lookup))
+        self.assertEqual(4, lookup['KD'])
+        self.assertEqual(1, lookup.misses)
+        self.assertEqual(2, len(lookup))
+        self.assertEqual(4, lookup['KD'])
+        self.assertEqual(1, lookup.misses)
+        self.assertIsNone(lookup.get('XX'))
+        self.assertIsNone(lookup.get('XX'))
+        self.assertEqual(2, lookup.misses)
+
+    def test_bounded_lookup_with_repeated_keys_queries_unloaded_keys(self):
+        self.conn.execute('CREATE TABLE codes (code TEXT, id INTEGER)')
+        self.conn.executemany('INSERT INTO codes VALUES (?, ?)', [
+            ('A', 1), ('A', 1), ('A', 1), ('B', 2)
+        ])
+        lookup = DbLookup(self.conn, 'codes', ['code'], ['id'], max_size=2)
+        self.assertTrue(lookup.bounded)
+        self.assertEqual(2, lookup.get('B'))
+        self.assertEqual(1, lookup.misses)
+
+    def test_unbounded_lookup_does_not_query(self):
+        lookup = DbLookup(self.conn, 'states', ['code'], ['id'], max_size=10)
+        self.assertFalse(lookup.bounded)
+        self.assertIsNone(lookup.get('XX'))
+        self.assertEqual(0, lookup.misses)
+
+    def test_lookup_can_be_passed_to_dml_builder(self):
+        rows = [_(state='KN', name='Ado'), _(state='LA', name='Ikeja')]
+        dml_provider = Db.make_dml_provider(
+            lambda row, ctx: "INSERT INTO lgas VALUES ('%s', %s)" % (
+                row.name, ctx.states[row.state]),
+            rows, context=_(
+                states=DbLookup(self.conn, 'states', ['code'], ['id']))
+        )
+        self.assertEqual([
+            "INSERT INTO lgas VALUES ('Ado', 1)",
+            "INSERT INTO lgas VALUES ('Ikeja', 2)"
+        ], list(dml_provider()))
+
+
 class XlSheetMixin:
     dir_base = os.path.dirname(__file__)
 
@@ -140,6 +560,166 @@ class XlSheetTestCase(unittest.TestCase, XlSheetMixin):
         hdr_idx = XlSheet.find_headers(xlsheet, ['sn', 'name'])
         self.assertEqual(-1, hdr_idx)
 
+    def _get_inflated_xlsheet(self):
+        workbook = openpyxl.Workbook()
+        worksheet = workbook.active
+        worksheet.title = 'inflated'
+        for i in range(1, 6):
+            for j in range(1, 4):
+                worksheet.cell(row=i, column=j).value = i * j
+        # formatted but empty cells inflate the reported dimensions
+        worksheet.cell(row=2000, column=200).number_format = '0.00'
+        return XlSheet(workbook, 'inflated')
+
+    def test_detects_data_extent_of_inflated_sheet(self):
+        xlsheet = self._get_inflated_xlsheet()
+        self.assertEqual(2000, xlsheet.max_row)
+        self.assertEqual(200, xlsheet.max_column)
+        self.assertEqual(5, xlsheet.data_max_row)
+        self.assertEqual(3, xlsheet.data_max_column)
+
+    def test_iteration_is_bounded_by_data_extent(self):
+        rows = list(self._get_inflated_xlsheet())
+        self.assertEqual(5, len(rows))
+        self.assertEqual((5, 10, 15), rows[-1])
+
+    def test_data_extent_spans_wide_column_gaps(self):
+        workbook = openpyxl.Workbook()
+        worksheet = workbook.active
+        worksheet.title = 'gaps'
+        worksheet.cell(row=1, column=1).value = 'id'
+        worksheet.cell(row=1, column=30).value = 'far'
+        worksheet.cell(row=2, column=1).value = 1
+        worksheet.cell(row=2, column=30).value = 'x'
+        worksheet.cell(row=2, column=60).number_format = '0.00'
+
+        xlsheet = XlSheet(workbook, 'gaps')
+        self.assertEqual(60, xlsheet.max_column)
+        self.assertEqual(30, xlsheet.data_max_column)
+        rows = list(xlsheet)
+        self.assertEqual('far', rows[0][-1])
+        self.assertEqual('x', rows[1][-1])
+
+    def test_data_extent_spans_long_row_gaps(self):
+        workbook = openpyxl.Workbook()
+        worksheet = workbook.active
+        worksheet.title = 'report'
+        worksheet.cell(row=1, column=1).value = 'Report title'
+        for i in range(150, 155):
+            worksheet.cell(row=i, column=1).value = i
+            worksheet.cell(row=i, column=3).value = 'row-%s' % i
+
+        xlsheet = XlSheet(workbook, 'report')
+        self.assertEqual(154, xlsheet.data_max_row)
+        self.assertEqual(3, xlsheet.data_max_column)
+        rows = list(xlsheet)
+        self.assertEqual(154, len(rows))
+        self.assertEqual((154, None, 'row-154'), rows[-1])
+
+    def test_data_extent_spans_columns_first_filled_low_down(self):
+        workbook = openpyxl.Workbook()
+        worksheet = workbook.active
+        worksheet.title = 'late'
+        for i in range(1, 121):
+            worksheet.cell(row=i, column=1).value = i
+            if i > 100:
+                worksheet.cell(row=i, column=5).value = 'x'
+
+        xlsheet = XlSheet(workbook, 'late')
+        self.assertEqual(5, xlsheet.data_max_column)
+        rows = list(xlsheet)
+        self.assertEqual((120, None, None, None, 'x'), rows[-1])
+
+    def test_data_extent_is_estimated_for_read_only_sheets(self):
+        filepath = os.path.join(self.dir_base, 'fixtures', 'school.xlsx')
+        workbook = openpyxl.load_workbook(filepath, read_only=True)
+        xlsheet = XlSheet(workbook, 'students')
+        self.assertEqual(12, xlsheet.data_max_row)
+        self.assertEqual(4, xlsheet.data_max_column)
+
+    def test_data_extent_spans_leading_empty_rows(self):
+        xlsheet = self._get_xlsheet()
+        self.assertEqual(12, xlsheet.data_max_row)
+        self.assertEqual(4, xlsheet.data_max_column)
+
+
+class XlSheetWriterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.filepath = tempfile.mkstemp(suffix='.xlsx')
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.filepath)
+
+    def _get_conn(self, count=10):
+        conn = sqlite3.connect(':memory:')
+        conn.execute('CREATE TABLE people (id INTEGER, name TEXT)')
+        conn.executemany('INSERT INTO people VALUES (?, ?)', [
+            (i, 'name-%s' % i) for i in range(1, count + 1)
+        ])
+        return conn
+
+    def _read_sheets(self):
+        workbook = openpyxl.load_workbook(self.filepath, read_only=True)
+        return [list(ws.iter_rows(values_only=True)) for ws in workbook]
+
+    def test_can_write_rows_from_row_provider(self):
+        rows = Db.make_row_provider(self._get_conn(), 'people')
+        with XlSheetWriter(self.filepath, 'people') as writer:
+            self.assertEqual(10, writer.write_rows(rows))
+
+        sheets = self._read_sheets()
+        self.assertEqual(1, len(sheets))
+        self.assertEqual(('id', 'name'), sheets[0][0])
+        self.assertEqual((10, 'name-10'), sheets[0][-1])
+
+    def test_can_write_tuples_with_headers_from_description(self):
+        cursor = self._get_conn(3).execute('SELECT * FROM people')
+        with XlSheetWriter(self.filepath,
+                headers=cursor.description) as writer:
+            writer.write_rows(cursor)
+
+        sheets = self._read_sheets()
+        self.assertEqual([('id', 'name'), (1, 'name-1'), (2, 'name-2'),
+            (3, 'name-3')], sheets[0])
+
+    def test_rolls_over_to_new_sheet_at_row_limit(self):
+        rows = Db.make_row_provider(self._get_conn(), 'people')
+        with XlSheetWriter(self.filepath, 'people', max_rows=4) as writer:
+            writer.write_rows(rows)
+        self.assertEqual(4, writer.sheet_count)
+        self.assertEqual(10, writer.row_count)
+
+        sheets = self._read_sheets()
+        self.assertEqual([4, 4, 4, 2], [len(s) for s in sheets])
+        self.assertTrue(all(s[0] == ('id', 'name') for s in sheets))
+        self.assertEqual((10, 'name-10'), sheets[-1][-1])
+
+
+    def test_close_can_be_called_more_than_once(self):
+        writer = XlSheetWriter(self.filepath)
+        writer.write_rows([(1, 2)])
+        writer.close()
+        writer.close()
+        self.assertEqual([[(1, 2)]], self._read_sheets())
+
+    def test_temporary_files_are_removed_when_writing_fails(self):
+        with self.assertRaises(RuntimeError):
+            with XlSheetWriter(self.filepath) as writer:
+                writer.write_rows([(1, 2), (3, 4)])
+                tempfile_path = writer.workbook.worksheets[0]._writer.out
+                self.assertTrue(os.path.isfile(tempfile_path))
+                raise RuntimeError('failed export')
+        self.assertFalse(os.path.isfile(tempfile_path))
+
+    def test_sheet_titles_are_kept_within_excel_limit(self):
+        name = 'x' * 30
+        with XlSheetWriter(self.filepath, name, max_rows=2) as writer:
+            writer.write_rows([(1,), (2,), (3,), (4,), (5,)])
+        titles = [ws.title for ws in writer.workbook.worksheets]
+        self.assertEqual([name, 'x' * 27 + ' (2)', 'x' * 27 + ' (3)'], titles)
+
 
 class TypedXlReaderTestCase(unittest.TestCase, XlSheetMixin):
     
@@ -154,3 +734,80 @@ class TypedXlReaderTestCase(unittest.TestCase, XlSheetMixin):
             self.assertIn("gender", row)
             break
 
+
+    def test_schema_reader_converts_rows(self):
+        reader = SchemaStudentReader(self._get_xlsheet())
+        rows = list(reader.get_rows())
+        self.assertEqual(5, len(rows))
+        self.assertEqual([], reader.errors)
+        self.assertIsInstance(rows[0], _)
+        self.assertEqual(1, rows[0].sn)
+        self.assertEqual('John Doe', rows[0].name)
+        self.assertEqual('M', rows[0].gender)
+        self.assertEqual(34, rows[0].age)
+
+    def test_schema_reader_collects_conversion_errors(self):
+        class Reader(TypedXlReaderBase):
+            sample_headers = ('sn', 'subject')
+            schema = (
+                XlColumn('sn', int),
+                XlColumn('teacher', int, default=-1, index=2),
+                XlColumn('room', required=True, index=3),
+            )
+
+        reader = Reader(self._get_xlsheet('subjects'))
+        rows = list(reader.get_rows())
+        self.assertEqual(10, len(rows))
+        self.assertEqual(-1, rows[0].teacher)
+        self.assertIsNone(rows[0].room)
+        self.assertEqual(20, len(reader.errors))
+        self.assertEqual((2, 'teacher'), reader.errors[0][:2])
+        self.assertEqual((2, 'room', 'value required'), reader.errors[1])
+
+    def test_schema_is_compiled_once_per_reader_class(self):
+        first = SchemaStudentReader(self._get_xlsheet())._get_row_converter()
+        second = SchemaStudentReader(self._get_xlsheet())._get_row_converter()
+        self.assertIs(first, second)
+
+    def test_schema_is_compiled_per_column_index_map(self):
+        class Reader(TypedXlReaderBase):
+            schema = (XlColumn('a'), XlColumn('b'))
+
+            def __init__(self, xlsheet, index_map):
+                super(Reader, self).__init__(xlsheet)
+                self.index_map = index_map
+
+            def _get_column_name_index_map(self):
+                return self.index_map
+
+        first = Reader(self._get_xlsheet(), _(a=0, b=1))._get_row_converter()
+        second = Reader(self._get_xlsheet(), _(a=1, b=0))._get_row_converter()
+        self.assertEqual(_(a=1, b=2), first((1, 2))[0])
+        self.assertEqual(_(a=2, b=1), second((1, 2))[0])
+
+    def test_compiled_schema_accepts_subclass_values(self):
+        import datetime
+
+        convert = TypedXlReaderBase.compile_schema([
+            XlColumn('dob', datetime.date)
+        ])
+        value = datetime.datetime(1990, 1, 2)
+        record, errors = convert((value,))
+        self.assertIs(value, record.dob)
+        self.assertIsNone(errors)
+
+    def test_cannot_create_reader_without_schema_or_get_rows(self):
+        class Reader(TypedXlReaderBase):
+            pass
+
+        with self.assertRaises(TypeError):
+            Reader(self._get_xlsheet())
+
+    def test_compiled_schema_handles_short_rows(self):
+        convert = TypedXlReaderBase.compile_schema([
+            XlColumn('a', int), XlColumn('b', default='x')
+        ])
+        record, errors = convert(('5',))
+        self.assertEqual(5, record.a)
+        self.assertEqual('x', record.b)
+        self.assertIsNone(errors)